@@ -2,12 +2,12 @@ import os
 import re
 import glob
 import hashlib
-from datetime import datetime, time, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, time
+from functools import lru_cache
 
 import pandas as pd
-from openpyxl import Workbook
-from openpyxl.styles import PatternFill, Font, Alignment, Border, Side
-from openpyxl.utils import get_column_letter
+import xlsxwriter
 
 
 # ==========================================================
@@ -37,31 +37,59 @@ DAY_ALIASES = {
     "sun": "Sunday", "sunday": "Sunday",
 }
 
-def normalize_day(val) -> str:
-    s = str(val).strip().lower()
-    s = re.sub(r"[^a-z]", "", s)
+_NON_ALPHA = re.compile(r"[^a-z]")
+
+@lru_cache(maxsize=1024)
+def _normalize_day_str(s: str):
+    s = _NON_ALPHA.sub("", s.strip().lower())
     if s in DAY_ALIASES:
         return DAY_ALIASES[s]
     if len(s) >= 3 and s[:3] in DAY_ALIASES:
         return DAY_ALIASES[s[:3]]
-    raise ValueError(f"Unrecognized day: {val!r}")
+    return None
 
-def parse_time(val) -> time:
-    """Accept Excel time/datetime or strings like '08:30', '8.30', '08:30:00'."""
-    if pd.isna(val):
+def normalize_day(val) -> str:
+    day = _normalize_day_str(str(val))
+    if day is None:
+        raise ValueError(f"Unrecognized day: {val!r}")
+    return day
+
+@lru_cache(maxsize=1024)
+def _parse_time_str(s: str):
+    s = s.strip().replace(".", ":")
+    # H:MM, HH:MM or HH:MM:SS, scanned by hand instead of a regex
+    i = s.find(":")
+    n = len(s)
+    if not (
+        1 <= i <= 2
+        and s[:i].isdecimal()
+        and s[i + 1:i + 3].isdecimal()
+        and (n == i + 3 or (n == i + 6 and s[i + 3] == ":" and s[i + 4:].isdecimal()))
+    ):
         return None
-    if isinstance(val, datetime):
-        return val.time().replace(second=0)
-    if isinstance(val, time):
-        return val.replace(second=0)
-
-    s = str(val).strip().replace(".", ":")
-    m = re.match(r"^\s*(\d{1,2}):(\d{2})(?::(\d{2}))?\s*$", s)
-    if not m:
+    hh = int(s[:i])
+    mm = int(s[i + 1:i + 3])
+    if hh > 23 or mm > 59:
+        return None
+    return hh * 60 + mm
+
+def parse_time(val) -> int:
+    """
+    Accept Excel time/datetime or strings like '08:30', '8.30', '08:30:00'.
+    Returns minutes since midnight.
+    """
+    if not isinstance(val, str):
+        if pd.isna(val):
+            return None
+        if isinstance(val, datetime):
+            return val.hour * 60 + val.minute
+        if isinstance(val, time):
+            return val.hour * 60 + val.minute
+
+    t = _parse_time_str(str(val))
+    if t is None:
         raise ValueError(f"Unrecognized time format: {val!r}")
-    hh = int(m.group(1))
-    mm = int(m.group(2))
-    return time(hh, mm, 0)
+    return t
 
 def standardize_df(df: pd.DataFrame) -> pd.DataFrame:
     """
@@ -99,37 +127,35 @@ def standardize_df(df: pd.DataFrame) -> pd.DataFrame:
     out.columns = ["course", "day", "start", "end"]
     return out
 
-def to_minutes(t: time) -> int:
-    return t.hour * 60 + t.minute
+# Slot rounding with the grid step baked in; works on ints and int columns alike
+def floor_slot(m):
+    return m - m % TIME_STEP_MIN
 
-def floor_minutes(m: int, step: int) -> int:
-    return (m // step) * step
+def ceil_slot(m):
+    return -(-m // TIME_STEP_MIN) * TIME_STEP_MIN
 
-def ceil_minutes(m: int, step: int) -> int:
-    return ((m + step - 1) // step) * step
+def format_minutes(m: int) -> str:
+    return f"{m // 60:02d}:{m % 60:02d}"
 
-def minutes_to_time(m: int) -> time:
-    return time(m // 60, m % 60, 0)
+def format_minutes_col(m: pd.Series) -> pd.Series:
+    """Vectorized format_minutes for a column of minute values."""
+    return (m // 60).astype(str).str.zfill(2) + ":" + (m % 60).astype(str).str.zfill(2)
 
-def iter_slots(start_min: int, end_min: int, step: int):
-    cur = start_min
-    while cur < end_min:
-        yield cur
-        cur += step
+def map_unique(col: pd.Series, func) -> pd.Series:
+    """Apply func once per distinct value of col instead of once per row."""
+    mapping = {v: func(v) for v in col.unique()}
+    return col.map(mapping)
 
 def student_color_hex(student_id: str) -> str:
     """
     Deterministic pastel-ish color based on student_id.
-    Returns 'RRGGBB'. openpyxl fill wants ARGB => 'FFRRGGBB'.
+    Returns 'RRGGBB'; xlsxwriter formats take it as '#RRGGBB'.
     """
-    h = hashlib.md5(student_id.encode("utf-8")).hexdigest()
-    r = int(h[0:2], 16)
-    g = int(h[2:4], 16)
-    b = int(h[4:6], 16)
+    r, g, b = hashlib.blake2s(student_id.encode("utf-8"), digest_size=3).digest()
     # pastelize
-    r = int((r + 255) / 2)
-    g = int((g + 255) / 2)
-    b = int((b + 255) / 2)
+    r = (r + 255) // 2
+    g = (g + 255) // 2
+    b = (b + 255) // 2
     return f"{r:02X}{g:02X}{b:02X}"
 
 
@@ -140,36 +166,35 @@ paths = sorted(glob.glob(INPUT_GLOB))
 if not paths:
     raise FileNotFoundError(f"No files matched INPUT_GLOB={INPUT_GLOB}")
 
-records = []
-students = []
-
-for path in paths:
+def load_one(path: str) -> pd.DataFrame:
+    """Read one student's timetable file and return its normalized rows."""
     student_id = os.path.splitext(os.path.basename(path))[0]
-    students.append(student_id)
 
-    raw = pd.read_excel(path)
+    raw = pd.read_excel(path, engine="calamine", dtype=object)
     df = standardize_df(raw).dropna(how="all")
 
     df["course"] = df["course"].astype(str).str.strip()
-    df["day"] = df["day"].apply(normalize_day)
-    df["start"] = df["start"].apply(parse_time)
-    df["end"] = df["end"].apply(parse_time)
+    df["day"] = map_unique(df["day"], normalize_day)
+    df["start"] = map_unique(df["start"], parse_time)
+    df["end"] = map_unique(df["end"], parse_time)
     df = df.dropna(subset=["course", "day", "start", "end"])
     df = df[df["course"].str.len() > 0].copy()
+    df["start"] = df["start"].astype("int64")
+    df["end"] = df["end"].astype("int64")
+
+    df = df.rename(columns={"course": "Course", "day": "Day", "start": "Start", "end": "End"})
+    df.insert(0, "Student", student_id)
+    return df
 
-    for _, r in df.iterrows():
-        records.append({
-            "Student": student_id,
-            "Course": r["course"],
-            "Day": r["day"],
-            "Start": r["start"],
-            "End": r["end"],
-        })
+students = [os.path.splitext(os.path.basename(p))[0] for p in paths]
 
-if not records:
+with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+    frames = list(executor.map(load_one, paths))
+
+df_all = pd.concat(frames, ignore_index=True)
+if df_all.empty:
     raise ValueError("No valid timetable rows found across input files.")
 
-df_all = pd.DataFrame(records)
 df_all["Day"] = pd.Categorical(df_all["Day"], categories=DAY_ORDER, ordered=True)
 df_all = df_all.sort_values(["Day", "Start", "Student", "Course"]).reset_index(drop=True)
 
@@ -178,139 +203,120 @@ student_to_color = {s: student_color_hex(s) for s in student_list}
 
 
 # ==========================================================
-# BUILD MATRIX KEYS: (Day, Slot) + student columns
+# BUILD MATRIX INTERVALS: (Day, Student) -> slot ranges
 # ==========================================================
-min_start = int(df_all["Start"].map(to_minutes).min())
-max_end = int(df_all["End"].map(to_minutes).max())
+min_start = int(df_all["Start"].min())
+max_end = int(df_all["End"].max())
 
-grid_start = floor_minutes(min_start, TIME_STEP_MIN)
-grid_end = ceil_minutes(max_end, TIME_STEP_MIN) + TIME_STEP_MIN
+grid_start = floor_slot(min_start)
+grid_end = ceil_slot(max_end) + TIME_STEP_MIN
 
 days_present = [d for d in DAY_ORDER if d in set(df_all["Day"].astype(str))]
 if not days_present:
     days_present = DAY_ORDER[:5]
 
-# Create dict for matrix cell text: (day, slot_min, student) -> list[str]
-cell_text = {}
-cell_has_class = set()  # (day, slot_min, student)
-
-for _, r in df_all.iterrows():
-    d = str(r["Day"])
-    if d not in days_present:
-        continue
-
-    st = to_minutes(r["Start"])
-    en = to_minutes(r["End"])
-    st_slot = floor_minutes(st, TIME_STEP_MIN)
-    en_slot = ceil_minutes(en, TIME_STEP_MIN)
+df_cells = df_all[df_all["Day"].astype(str).isin(days_present)]
 
-    s = r["Student"]
-    label = f"{r['Course']}\n{r['Start'].strftime('%H:%M')}–{r['End'].strftime('%H:%M')}"
+labels = (
+    df_cells["Course"] + "\n"
+    + format_minutes_col(df_cells["Start"]) + "–" + format_minutes_col(df_cells["End"])
+)
+st_slots = floor_slot(df_cells["Start"])
+en_slots = ceil_slot(df_cells["End"])
 
-    for slot in iter_slots(st_slot, en_slot, TIME_STEP_MIN):
-        key = (d, slot, s)
-        cell_text.setdefault(key, []).append(label)
-        cell_has_class.add(key)
+# Slot intervals per day and student: day -> student -> [(st_slot, en_slot, label)].
+# df_all is sorted by start, so each list is already in slot order.
+intervals = {}
+for d, s, st, en, label in zip(df_cells["Day"].astype(str), df_cells["Student"], st_slots, en_slots, labels):
+    intervals.setdefault(d, {}).setdefault(s, []).append((int(st), int(en), label))
 
 
 # ==========================================================
 # WRITE EXCEL (Matrix layout)
 # Columns: Day | Time | Student1 | Student2 | ...
 # ==========================================================
-wb = Workbook()
-ws = wb.active
-ws.title = SHEET_MATRIX
-ws_leg = wb.create_sheet(SHEET_LEGEND)
+wb = xlsxwriter.Workbook(OUTPUT_XLSX, {"constant_memory": True})
+ws = wb.add_worksheet(SHEET_MATRIX)
+ws_leg = wb.add_worksheet(SHEET_LEGEND)
 
 # Styles
-thin = Side(style="thin", color="999999")
-border = Border(left=thin, right=thin, top=thin, bottom=thin)
-hdr_fill = PatternFill("solid", fgColor="F2F2F2")
-hdr_font = Font(bold=True)
-center_wrap = Alignment(horizontal="center", vertical="center", wrap_text=True)
-left_wrap = Alignment(horizontal="left", vertical="top", wrap_text=True)
+border = {"border": 1, "border_color": "#999999"}
+center_wrap = {"align": "center", "valign": "vcenter", "text_wrap": True}
+left_wrap = {"align": "left", "valign": "top", "text_wrap": True}
+hdr_fmt = wb.add_format({**border, **center_wrap, "bold": True, "bg_color": "#F2F2F2"})
+center_fmt = wb.add_format({**border, **center_wrap})
+default_fmt = wb.add_format({**border, **left_wrap})
+grid_fmt = wb.add_format(border)
+student_to_format = {
+    s: wb.add_format({**border, **left_wrap, "bold": True, "bg_color": "#" + hexrgb})
+    for s, hexrgb in student_to_color.items()
+}
+student_to_swatch = {
+    s: wb.add_format({**border, **center_wrap, "bg_color": "#" + hexrgb})
+    for s, hexrgb in student_to_color.items()
+}
 
 # Header
 headers = ["Day", "Time"] + student_list
-ws.append(headers)
-
-for j, h in enumerate(headers, start=1):
-    c = ws.cell(row=1, column=j)
-    c.font = hdr_font
-    c.fill = hdr_fill
-    c.border = border
-    c.alignment = center_wrap
-    # widths
-    if h == "Day":
-        ws.column_dimensions[get_column_letter(j)].width = 14
-    elif h == "Time":
-        ws.column_dimensions[get_column_letter(j)].width = 10
-    else:
-        ws.column_dimensions[get_column_letter(j)].width = 28
-
-# Rows: iterate Day then slots
-row_idx = 2
+ws.freeze_panes(1, 2)  # header & first two cols
+ws.write_row(0, 0, headers, hdr_fmt)
+
+# widths: Day, Time, then one range for all student columns
+ws.set_column(0, 0, 14)
+ws.set_column(1, 1, 10)
+ws.set_column(2, len(headers) - 1, 28)
+
+# Rows: iterate Day then slots (rows must be written in order in constant_memory mode)
+row_idx = 1
+slot_range = range(grid_start, grid_end, TIME_STEP_MIN)
+last_col = len(headers) - 1
 for day in days_present:
-    for slot in iter_slots(grid_start, grid_end, TIME_STEP_MIN):
-        ws.cell(row=row_idx, column=1, value=day).border = border
-        ws.cell(row=row_idx, column=1).alignment = center_wrap
-
-        t_label = minutes_to_time(slot).strftime("%H:%M")
-        ws.cell(row=row_idx, column=2, value=t_label).border = border
-        ws.cell(row=row_idx, column=2).alignment = center_wrap
-
-        # student columns
-        for k, student in enumerate(student_list, start=3):
-            key = (day, slot, student)
-            cell = ws.cell(row=row_idx, column=k)
-
-            # default border/alignment
-            cell.border = border
-            cell.alignment = left_wrap
-
-            if key in cell_has_class:
+    day_first_row = row_idx
+
+    # One lane per student with classes today: (column, format, intervals, [next index], active intervals)
+    by_student = intervals.get(day, {})
+    lanes = [
+        (k, student_to_format[student], by_student[student], [0], [])
+        for k, student in enumerate(student_list, start=2)
+        if student in by_student
+    ]
+
+    for slot in slot_range:
+        # Make it easier to scan: group by day visually (optional row height)
+        ws.set_row(row_idx, 42)
+        ws.write(row_idx, 0, day, center_fmt)
+        ws.write(row_idx, 1, format_minutes(slot), center_fmt)
+
+        # student columns: advance each lane to this slot
+        for k, fmt, ivs, nxt, active in lanes:
+            while nxt[0] < len(ivs) and ivs[nxt[0]][0] <= slot:
+                active.append(ivs[nxt[0]])
+                nxt[0] += 1
+            if active:
+                active[:] = [iv for iv in active if iv[1] > slot]
+            if active:
                 # Fill with student's color and write text
-                hexrgb = student_to_color[student]
-                cell.fill = PatternFill("solid", fgColor="FF" + hexrgb)
-                cell.value = "\n".join(cell_text.get(key, []))
-                cell.font = Font(bold=True)
+                ws.write(row_idx, k, "\n".join(iv[2] for iv in active), fmt)
 
         row_idx += 1
-    row_idx += 1
-
-# Freeze header & first two cols
-ws.freeze_panes = "C2"
 
-# Make it easier to scan: group by day visually (optional row height)
-for r in range(2, ws.max_row + 1):
-    ws.row_dimensions[r].height = 42
+    # Empty student cells are never written; draw their grid with one range rule per day
+    ws.conditional_format(day_first_row, 2, row_idx - 1, last_col, {"type": "no_errors", "format": grid_fmt})
+    row_idx += 1
 
 # ==========================================================
 # Legend sheet
 # ==========================================================
-ws_leg.append(["Student", "Color"])
-for j in range(1, 3):
-    c = ws_leg.cell(row=1, column=j)
-    c.font = hdr_font
-    c.fill = hdr_fill
-    c.border = border
-    c.alignment = center_wrap
-
-ws_leg.column_dimensions["A"].width = 45
-ws_leg.column_dimensions["B"].width = 18
-
-for i, student in enumerate(student_list, start=2):
-    hexrgb = student_to_color[student]
-    ws_leg.cell(row=i, column=1, value=student).border = border
-    ws_leg.cell(row=i, column=1).alignment = left_wrap
+ws_leg.freeze_panes(1, 0)
+ws_leg.write_row(0, 0, ["Student", "Color"], hdr_fmt)
 
-    c = ws_leg.cell(row=i, column=2, value=hexrgb)
-    c.fill = PatternFill("solid", fgColor="FF" + hexrgb)
-    c.border = border
-    c.alignment = center_wrap
+ws_leg.set_column(0, 0, 45)
+ws_leg.set_column(1, 1, 18)
 
-ws_leg.freeze_panes = "A2"
+for i, student in enumerate(student_list, start=1):
+    ws_leg.write(i, 0, student, default_fmt)
+    ws_leg.write(i, 1, student_to_color[student], student_to_swatch[student])
 
 # Save
-wb.save(OUTPUT_XLSX)
+wb.close()
 print(f"Saved: {OUTPUT_XLSX}")